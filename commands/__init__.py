@@ -1,9 +1,10 @@
 from .correlate import correlate_and_plot
 from .mastora import compute_mastora
-from .qanadli import compute_qanadli
+from .qanadli import annotate_qanadli_edges, compute_qanadli
 from .visualize import visualize_attribute_graph_pyvis
 
 __all__ = [
+    "annotate_qanadli_edges",
     "compute_mastora",
     "compute_qanadli",
     "correlate_and_plot",
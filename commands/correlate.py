@@ -1,16 +1,23 @@
+import os
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from pathlib import Path
 
 import click
+import networkx as nx
+import numpy as np
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
-import plotly.io as pio
-from plotly.subplots import make_subplots
-from scipy.stats import pearsonr
 
 from commands.mastora import compute_mastora
-from commands.qanadli import compute_qanadli
-from tree import add_max_attribute_values, json_to_directed_graph
+from commands.qanadli import annotate_qanadli_edges, compute_qanadli
+from tree import GRAPH_FILENAME_TEMPLATE, load_attribute_graph
+
+OBSTRUCTION_ATTRIBUTES = [
+    "max_transversal_obstruction",
+    "max_transversal_obstruction_propagated",
+    "max_transversal_obstruction_cumulated",
+]
 
 
 def load_and_clean_clinical_data(file_path: Path, attribute: str) -> pd.DataFrame:
@@ -23,16 +30,22 @@ def load_and_clean_clinical_data(file_path: Path, attribute: str) -> pd.DataFram
     Returns:
         A pandas DataFrame with cleaned clinical data.
     """
-    df = pd.read_csv(file_path)
-    # The values can be '< 3' or 'NF'
-    df[attribute] = df[attribute].astype(str).str.replace(r"<", "").str.strip()
-    df[attribute] = pd.to_numeric(df[attribute], errors="coerce")
+    df = pd.read_csv(file_path, usecols=["patient_id", attribute])
+    # The values can be '< 3' or 'NF', keep what follows an optional '<' and let non-numbers become NaN
+    values = df[attribute].astype(str).str.extract(r"^\s*<?\s*(.*?)\s*$", expand=False)
+    df[attribute] = pd.to_numeric(values, errors="coerce")
     df.dropna(subset=[attribute], inplace=True)
     return df
 
 
 def calculate_scores(
-    score_name: str, clinical_data: pd.DataFrame, graphs_dir: Path, obstruction_attr: str, all_attributes: bool = False
+    score_name: str,
+    clinical_data: pd.DataFrame,
+    graphs_dir: Path,
+    obstruction_attr: str,
+    all_attributes: bool = False,
+    jobs: int = 1,
+    use_cache: bool = True,
 ) -> pd.DataFrame:
     """Calculate scores for each patient in the clinical data.
 
@@ -42,82 +55,118 @@ def calculate_scores(
         graphs_dir: The path to the directory containing graph files.
         obstruction_attr: The edge attribute to use for obstruction values.
         all_attributes: If True, calculate scores for all obstruction attributes.
+        jobs: Number of worker processes used to score the patient graphs. 1 processes them sequentially, -1 uses
+            all CPU cores.
+        use_cache: If True, reuse the attribute graphs cached on disk, see `load_attribute_graph`.
 
     Returns:
         A pandas DataFrame with patient IDs, clinical attributes, and calculated scores.
     """
-    if all_attributes:
-        all_attrs = [
-            "max_transversal_obstruction",
-            "max_transversal_obstruction_propagated",
-            "max_transversal_obstruction_cumulated",
-        ]
-        all_scores = []
-        all_patient_ids = []
-        all_attr_names = []
-
-        for attr in all_attrs:
-            for _, row in clinical_data.iterrows():
-                patient_id = row["patient_id"]
-                patient_id_str = str(patient_id).zfill(4)
-                graph_file = graphs_dir / f"{patient_id_str}_graph_ep_transversal_obstruction.json"
-
-                if not graph_file.is_file():
-                    continue
-
-                try:
-                    graph = json_to_directed_graph(graph_file)
-                    new_graph = add_max_attribute_values(graph)
-
-                    if score_name == "mastora":
-                        score = compute_mastora(new_graph, obstruction_attr=attr)
-                    elif score_name == "qanadli":
-                        score = compute_qanadli(new_graph, obstruction_attr=attr)
-                    else:
-                        raise ValueError(f"Invalid score name: {score_name}")
-
-                    all_scores.append(score)
-                    all_patient_ids.append(patient_id)
-                    all_attr_names.append(attr)
-
-                except Exception as e:
-                    click.echo(f"Could not process graph for patient {patient_id_str} with attr {attr}: {e}", err=True)
-
-        score_df = pd.DataFrame(
-            {"patient_id": all_patient_ids, "score": all_scores, "obstruction_attr": all_attr_names}
-        )
-        return pd.merge(clinical_data, score_df, on="patient_id")
+    attrs = OBSTRUCTION_ATTRIBUTES if all_attributes else [obstruction_attr]
+
+    if score_name == "mastora":
+        compute_score = compute_mastora
+        prepare_graph = None
+    elif score_name == "qanadli":
+        compute_score = compute_qanadli
+        # The topology annotations are shared by the scores of every obstruction attribute
+        prepare_graph = annotate_qanadli_edges
+    else:
+        raise ValueError(f"Invalid score name: {score_name}")
+
+    # Scan the directory once instead of checking each patient's file separately
+    available_files = set()
+    if graphs_dir.is_dir():
+        with os.scandir(graphs_dir) as entries:
+            available_files = {entry.name for entry in entries if entry.is_file()}
+
+    row_positions = []
+    patient_id_strs = []
+    graph_files = []
+    for position, patient_id in enumerate(clinical_data["patient_id"].to_numpy()):
+        patient_id_str = str(patient_id).zfill(4)
+        graph_filename = GRAPH_FILENAME_TEMPLATE.format(patient_id_str)
+        if graph_filename in available_files:
+            row_positions.append(position)
+            patient_id_strs.append(patient_id_str)
+            graph_files.append(graphs_dir / graph_filename)
+
+    args = (
+        graph_files,
+        patient_id_strs,
+        repeat(compute_score),
+        repeat(attrs),
+        repeat(use_cache),
+        repeat(prepare_graph),
+    )
+    if jobs == 1:
+        results = list(map(score_patient_graph, *args))
+    else:
+        with ProcessPoolExecutor(max_workers=None if jobs == -1 else jobs) as executor:
+            results = list(executor.map(score_patient_graph, *args))
 
+    # One output row per computed score, pointing back to the patient's clinical data row
+    scored_positions = []
     scores = []
-    patient_ids_with_scores = []
+    attr_names = []
 
-    for _, row in clinical_data.iterrows():
-        patient_id = row["patient_id"]
-        patient_id_str = str(patient_id).zfill(4)
-        graph_file = graphs_dir / f"{patient_id_str}_graph_ep_transversal_obstruction.json"
+    for position, (patient_scores, errors) in zip(row_positions, results, strict=True):
+        for error in errors:
+            click.echo(error, err=True)
+        for attr, score in patient_scores:
+            scored_positions.append(position)
+            scores.append(score)
+            attr_names.append(attr)
 
-        if not graph_file.is_file():
-            continue
+    data = clinical_data.iloc[scored_positions].reset_index(drop=True)
+    data["score"] = scores
+    if all_attributes:
+        # Only a few distinct attribute names repeated on every row
+        data["obstruction_attr"] = pd.Categorical(attr_names, categories=OBSTRUCTION_ATTRIBUTES)
+    return data
 
-        try:
-            graph = json_to_directed_graph(graph_file)
-            new_graph = add_max_attribute_values(graph)
 
-            if score_name == "mastora":
-                score = compute_mastora(new_graph, obstruction_attr=obstruction_attr)
-            elif score_name == "qanadli":
-                score = compute_qanadli(new_graph, obstruction_attr=obstruction_attr)
-            else:
-                raise ValueError(f"Invalid score name: {score_name}")
+def score_patient_graph(
+    graph_file: Path,
+    patient_id_str: str,
+    compute_score: Callable[..., float],
+    attrs: list[str],
+    use_cache: bool = True,
+    prepare_graph: Callable[[nx.DiGraph], nx.DiGraph] | None = None,
+) -> tuple[list[tuple[str, float]], list[str]]:
+    """Load a patient graph and compute its score for each obstruction attribute.
 
-            scores.append(score)
-            patient_ids_with_scores.append(patient_id)
+    Runs in a worker process when scores are calculated in parallel, so errors are returned instead of echoed.
 
-        except Exception as e:
-            click.echo(f"Could not process graph for patient {patient_id_str}: {e}", err=True)
+    Args:
+        graph_file: The path to the patient graph file.
+        patient_id_str: The zero-padded patient ID, used in error messages.
+        compute_score: The score function to apply to the graph.
+        attrs: The edge attributes to use for obstruction values.
+        use_cache: If True, reuse the attribute graph cached on disk.
+        prepare_graph: Function applied once to the loaded graph before computing the scores, e.g. to precompute what
+            `compute_score` needs for every obstruction attribute.
+
+    Returns:
+        A tuple (scores, errors) where scores holds (obstruction_attr, score) tuples and errors holds the messages of
+        the computations that failed.
+    """
+    try:
+        # Load the graph once and reuse it for every obstruction attribute
+        new_graph = load_attribute_graph(graph_file, use_cache=use_cache)
+        if prepare_graph is not None:
+            prepare_graph(new_graph)
+    except Exception as e:
+        return [], [f"Could not process graph for patient {patient_id_str}: {e}"]
 
-    score_df = pd.DataFrame({"patient_id": patient_ids_with_scores, "score": scores})
-    return pd.merge(clinical_data, score_df, on="patient_id")
+    scores = []
+    errors = []
+    for attr in attrs:
+        try:
+            scores.append((attr, compute_score(new_graph, obstruction_attr=attr)))
+        except Exception as e:
+            errors.append(f"Could not process graph for patient {patient_id_str} with attr {attr}: {e}")
+    return scores, errors
 
 
 def calculate_pearson_correlation(data: pd.DataFrame, score_col: str, attribute_col: str) -> tuple[float, float]:
@@ -137,8 +186,39 @@ def calculate_pearson_correlation(data: pd.DataFrame, score_col: str, attribute_
     if len(clean_data) < 2:
         return float("nan"), float("nan")
 
-    correlation, p_value = pearsonr(clean_data[score_col], clean_data[attribute_col])
-    return correlation, p_value
+    x = clean_data[score_col].to_numpy(dtype=np.float64)
+    y = clean_data[attribute_col].to_numpy(dtype=np.float64)
+    xm = x - x.mean()
+    ym = y - y.mean()
+    denominator = np.sqrt((xm @ xm) * (ym @ ym))
+    if denominator == 0:
+        # Pearson correlation is undefined for constant inputs
+        return float("nan"), float("nan")
+
+    correlation = float(np.clip((xm @ ym) / denominator, -1.0, 1.0))
+    return correlation, pearson_p_value(correlation, len(clean_data))
+
+
+def pearson_p_value(correlation: float, n: int) -> float:
+    """Compute the two-sided p-value of a Pearson correlation coefficient.
+
+    Uses the exact distribution of the coefficient under the null hypothesis, which matches the p-value returned by
+    `scipy.stats.pearsonr`.
+
+    Args:
+        correlation: Pearson correlation coefficient
+        n: Number of samples the coefficient was computed from
+
+    Returns:
+        Two-sided p-value
+    """
+    if n <= 2:
+        return 1.0
+    from scipy.special import betainc
+
+    df = n - 2
+    # The t-statistic t satisfies df / (df + t^2) = 1 - r^2
+    return float(betainc(df / 2, 0.5, 1.0 - correlation**2))
 
 
 def plot_correlation(
@@ -165,6 +245,10 @@ def plot_correlation(
         all_attributes: If True, create subplots for each obstruction attribute with color coding by patient ID.
         show_visualization: If True, display the correlation plot visualization in browser.
     """
+    # Plotly is only needed for plotting, keep it out of the module import path
+    import plotly.express as px
+    import plotly.io as pio
+
     # Set plotly to use browser renderer
     pio.renderers.default = "browser"
 
@@ -173,34 +257,10 @@ def plot_correlation(
         unique_attrs = data["obstruction_attr"].unique()
         n_attrs = len(unique_attrs)
 
-        # Create subplots - arrange in a row
-        fig = make_subplots(
-            rows=1,
-            cols=n_attrs,
-            subplot_titles=[
-                attr.replace("max_transversal_obstruction", "Max Transversal Obstruction")
-                .replace("_propagated", " Propagated")
-                .replace("_cumulated", " Cumulated")
-                for attr in unique_attrs
-            ],
-            shared_yaxes=True,
-            horizontal_spacing=0.08,
-        )
-
-        # Generate consistent colors for each patient ID across all subplots
-        unique_patient_ids = sorted(data["patient_id"].unique())
-        colors = px.colors.qualitative.Dark2[: len(unique_patient_ids)]
-        if len(unique_patient_ids) > len(colors):
-            colors = colors * (len(unique_patient_ids) // len(colors) + 1)
-        patient_color_map = {pid: colors[i] for i, pid in enumerate(unique_patient_ids)}
-
         # Calculate and display correlation statistics for each attribute
         correlation_stats = {}
 
-        # Add scatter plots for each obstruction attribute
-        for i, attr in enumerate(unique_attrs):
-            attr_data = data[data["obstruction_attr"] == attr]
-
+        for attr, attr_data in data.groupby("obstruction_attr", sort=False, observed=True):
             # Calculate and always print correlation for this attribute
             correlation, p_value = calculate_pearson_correlation(attr_data, "score", attribute)
             correlation_stats[attr] = (correlation, p_value)
@@ -211,26 +271,42 @@ def plot_correlation(
             else:
                 click.echo(f"Pearson correlation for {attr}: insufficient data")
 
-            for patient_id in unique_patient_ids:
-                patient_data = attr_data[attr_data["patient_id"] == patient_id]
-
-                if not patient_data.empty:
-                    fig.add_trace(
-                        go.Scatter(
-                            x=patient_data["score"],
-                            y=patient_data[attribute],
-                            mode="markers",
-                            marker={"size": 12, "color": patient_color_map[patient_id], "opacity": 0.75},
-                            name=f"Patient {patient_id}",
-                            legendgroup=f"patient_{patient_id}",
-                            showlegend=i == 0,  # Only show legend for first subplot
-                            hovertemplate=f"Patient ID: {patient_id}<br>"
-                            f"{score_name.capitalize()} Score: %{{x}}<br>"
-                            f"{attribute.capitalize()}: %{{y}}<extra></extra>",
-                        ),
-                        row=1,
-                        col=i + 1,
-                    )
+        # Create one scatter subplot per obstruction attribute - arrange in a row, with one trace per patient ID so that
+        # colors are consistent across all subplots
+        patient_codes, unique_patient_ids = pd.factorize(data["patient_id"], sort=True)
+        patient_labels = np.array([f"Patient {patient_id}" for patient_id in unique_patient_ids])
+        fig = px.scatter(
+            data.assign(patient=patient_labels[patient_codes]),
+            x="score",
+            y=attribute,
+            color="patient",
+            facet_col="obstruction_attr",
+            facet_col_spacing=0.08,
+            category_orders={
+                "obstruction_attr": list(unique_attrs),
+                "patient": list(patient_labels),
+            },
+            color_discrete_sequence=px.colors.qualitative.Dark2,
+            opacity=0.75,
+            custom_data=["patient_id"],
+        )
+        fig.update_traces(
+            marker_size=12,
+            hovertemplate="Patient ID: %{customdata[0]}<br>"
+            f"{score_name.capitalize()} Score: %{{x}}<br>"
+            f"{attribute.capitalize()}: %{{y}}<extra></extra>",
+        )
+        # Facet titles styled as subplot titles, `px` facets otherwise share the x axes and label them "key=value"
+        fig.update_xaxes(matches=None)
+        fig.for_each_annotation(
+            lambda annotation: annotation.update(
+                text=annotation.text.split("=", 1)[-1]
+                .replace("max_transversal_obstruction", "Max Transversal Obstruction")
+                .replace("_propagated", " Propagated")
+                .replace("_cumulated", " Cumulated"),
+                font_size=16,
+            )
+        )
 
         # Update layout
         title_text = (
@@ -245,7 +321,9 @@ def plot_correlation(
             title_font_size=18,
             plot_bgcolor="white",
             showlegend=True,
-            legend={"orientation": "v", "yanchor": "top", "y": 1, "xanchor": "left", "x": 1.02},
+            # Drop the legend title set by `px` and restore the default gap between patients' legend groups
+            legend_title_text=None,
+            legend={"orientation": "v", "yanchor": "top", "y": 1, "xanchor": "left", "x": 1.02, "tracegroupgap": 10},
             height=800,
             margin={"t": 200},
         )
@@ -310,6 +388,8 @@ def correlate_and_plot(
     cli_command: str,
     all_attributes: bool = False,
     show_visualization: bool = False,
+    jobs: int = 1,
+    use_cache: bool = True,
 ) -> None:
     """Load data, calculate scores, and plot the correlation.
 
@@ -322,6 +402,8 @@ def correlate_and_plot(
         cli_command: The CLI command used to run this function, for display in the plot title.
         all_attributes: If True, calculate and plot scores for all obstruction attributes.
         show_visualization: If True, display the correlation plot visualization in browser.
+        jobs: Number of worker processes used to score the patient graphs. -1 uses all CPU cores.
+        use_cache: If True, reuse the attribute graphs cached on disk.
     """
     clinical_path = Path(clinical_data_path)
     graphs_dir = Path(graphs_dir_path)
@@ -334,7 +416,9 @@ def correlate_and_plot(
     else:
         click.echo(f"Calculating {score_name} scores for patients...")
 
-    data_with_scores = calculate_scores(score_name, clinical_df, graphs_dir, obstruction_attr, all_attributes)
+    data_with_scores = calculate_scores(
+        score_name, clinical_df, graphs_dir, obstruction_attr, all_attributes, jobs, use_cache
+    )
 
     if data_with_scores.empty:
         click.echo("No data to plot. Make sure graph files exist and patient IDs match.", err=True)
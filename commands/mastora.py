@@ -1,9 +1,11 @@
-from typing import Any
-
 import networkx as nx
+import numpy as np
 
 from tree import find_root
 
+# Width of the obstruction range of each Mastora degree, degree d + 1 covering [d * step, (d + 1) * step)
+MASTORA_DEGREE_STEP = 0.25
+
 
 def compute_mastora(
     graph: nx.DiGraph,
@@ -34,33 +36,40 @@ def compute_mastora(
         "l": [3],  # lobar
         "s": [4],  # segmental
     }
-    levels = [lvl for key in mode for lvl in level_map.get(key, [])]
+    levels = frozenset(lvl for key in mode for lvl in level_map.get(key, []))
 
+    # Degrees are summed during the traversal rather than collected, see `compute_mastora_score` for the same formula
+    total = 0.0 if use_percentage else 0
+    count = 0
     debug_edges = []
     debug_labels = []
 
-    def _dfs(node: Any) -> list:
-        degs = []
-        for succ in graph.successors(node):
-            attrs = graph.edges[node, succ]
-            if attrs.get("level", 0) in levels:
+    # Iterative pre-order traversal, the stack holds the iterator over the remaining children of each node on the path
+    succ = graph._succ  # raw adjacency dicts, avoid building an AtlasView per node
+    root = find_root(graph)
+    stack = [(root, iter(succ[root].items()))]
+    while stack:
+        node, children = stack[-1]
+        for child, attrs in children:
+            artery_level = attrs.get("level", 0)
+            if artery_level in levels:
                 obs_value = attrs.get(obstruction_attr, 0.0)
-                degs.append(obs_value)
+                total += obs_value if use_percentage else int(obs_value / MASTORA_DEGREE_STEP) + 1
+                count += 1
 
                 if debug:
-                    debug_edges.append((node, succ))
-                    artery_level = attrs.get("level", 0)
+                    debug_edges.append((node, child))
                     level_type = (
                         "M" if artery_level in level_map["m"] else "L" if artery_level in level_map["l"] else "S"
                     )
                     debug_labels.append(f"{level_type}: {obs_value:.2f}")
 
-            degs.extend(_dfs(succ))
-        return degs
+            stack.append((child, iter(succ[child].items())))
+            break
+        else:
+            stack.pop()
 
-    root = find_root(graph)
-    degrees = _dfs(root)
-    score = compute_mastora_score(degrees, use_percentage) if degrees else 0.0
+    score = _normalize_mastora_total(total, count, use_percentage) if count else 0.0
 
     if debug:
         return score, debug_edges, debug_labels
@@ -79,11 +88,30 @@ def compute_mastora_score(degrees: list[float], use_percentage: bool = False) ->
 
     Returns:
         float: The Mastora score, a float between 0 and 1.
+
+    Raises:
+        ValueError: If `use_percentage` is False and a degree is NaN or infinite, which has no degree bucket.
+    """
+    obstructions = np.asarray(degrees, dtype=np.float64)
+    n = len(obstructions)
+    if use_percentage:
+        return _normalize_mastora_total(float(obstructions.sum()), n, use_percentage)
+    if not np.isfinite(obstructions).all():
+        raise ValueError("Cannot convert non-finite obstruction degrees to Mastora degrees.")
+    # Truncation matches int() for the non-negative obstruction values
+    scored_degrees = (obstructions / MASTORA_DEGREE_STEP).astype(np.int64) + 1
+    return _normalize_mastora_total(int(scored_degrees.sum()), n, use_percentage)
+
+
+def _normalize_mastora_total(total: float, count: int, use_percentage: bool) -> float:
+    """Turn the sum of `count` degrees into the Mastora score, between 0 and 1.
+
+    Args:
+        total (float): Sum of the obstruction percentages, or of the degrees between 1 and 5.
+        count (int): Number of summed degrees, at least 1.
+        use_percentage (bool): Whether `total` sums obstruction percentages.
+
+    Returns:
+        float: The Mastora score.
     """
-    # click.echo(degrees)
-    if not use_percentage:
-        degrees = [int(float(degree) / 0.25) + 1 for degree in degrees]
-    # click.echo(degrees)
-    sum_degrees = sum(degrees)
-    n = len(degrees)
-    return sum_degrees / n if use_percentage else sum_degrees / (n * 5)
+    return total / count if use_percentage else total / (count * 5)
@@ -1,9 +1,14 @@
 from typing import Any
 
 import networkx as nx
+import numpy as np
 
 from tree import find_root
 
+# Edge attributes caching the topology-derived values set by `annotate_qanadli_edges`
+ARTERIE_TYPE_ATTR = "_arterie_type"
+SUBSEGMENTS_BELOW_ATTR = "_subsegments_below"
+
 
 def compute_qanadli(
     graph: nx.DiGraph,
@@ -35,15 +40,22 @@ def compute_qanadli(
     debug_edges: list[tuple] = []
     debug_labels: list[str] = []
 
-    def _dfs(node: Any) -> None:
-        for child in graph.successors(node):
-            edge_attrs = graph.edges[node, child]
+    # Iterative depth-first traversal, children are only pushed when the traversal continues below an edge
+    succ = graph._succ  # raw adjacency dicts, avoid building an AtlasView per node
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        for child, edge_attrs in succ[node].items():
             mto = edge_attrs.get(obstruction_attr, 0.0)
-            arterie_type = get_arterie_type(edge_attrs)
+            arterie_type = edge_attrs.get(ARTERIE_TYPE_ATTR)
+            if arterie_type is None:
+                arterie_type = get_arterie_type(edge_attrs)
 
             if arterie_type == "mediastinal" or arterie_type == "lobar":
                 if mto > min_obstruction_thresh:
-                    weight = get_subsegments_below(edge_attrs)
+                    weight = edge_attrs.get(SUBSEGMENTS_BELOW_ATTR)
+                    if weight is None:
+                        weight = get_subsegments_below(edge_attrs)
                     weights.append(weight)
                     degrees.append(mto)
 
@@ -52,7 +64,7 @@ def compute_qanadli(
                         degree_value = 0 if mto < min_obstruction_thresh else 1 if mto < max_obstruction_thresh else 2
                         debug_labels.append(f"{arterie_type[0].upper()}: {mto:.2f} (w:{weight}, d:{degree_value})")
                 else:
-                    _dfs(child)
+                    stack.append(child)
             elif arterie_type == "segmental":
                 weights.append(1)
                 degrees.append(mto)
@@ -62,9 +74,8 @@ def compute_qanadli(
                     degree_value = 0 if mto < min_obstruction_thresh else 1 if mto < max_obstruction_thresh else 2
                     debug_labels.append(f"S: {mto:.2f} (w:1, d:{degree_value})")
             elif arterie_type == "root":
-                _dfs(child)
+                stack.append(child)
 
-    _dfs(root)
     score = compute_qanadli_score(weights, degrees, min_obstruction_thresh, max_obstruction_thresh) if degrees else 0.0
 
     if debug:
@@ -72,6 +83,24 @@ def compute_qanadli(
     return score
 
 
+def annotate_qanadli_edges(graph: nx.DiGraph) -> nx.DiGraph:
+    """Store the artery type and the number of subsegments below on each edge of the graph.
+
+    Both values only depend on the tree topology, so computing them once lets repeated `compute_qanadli` calls on the
+    same graph (e.g. for several obstruction attributes) skip their computation.
+
+    Args:
+        graph (nx.DiGraph): Directed graph representing the arterial tree. Modified in place.
+
+    Returns:
+        nx.DiGraph: The annotated graph.
+    """
+    for _, _, edge_attrs in graph.edges(data=True):
+        edge_attrs[ARTERIE_TYPE_ATTR] = get_arterie_type(edge_attrs)
+        edge_attrs[SUBSEGMENTS_BELOW_ATTR] = get_subsegments_below(edge_attrs)
+    return graph
+
+
 def get_arterie_type(edge: dict[str, Any]) -> str:
     """Get the type of artery based on the edge attributes.
 
@@ -89,8 +118,6 @@ def get_arterie_type(edge: dict[str, Any]) -> str:
     if level == 4:
         return "segmental"
     if level == 3:
-        if all(succ.get("level", 0) == 4 for succ in edge.get("successors", [])):
-            return "lobar"  # return "segmental" in normal cases
         return "lobar"
     return ""
 
@@ -104,19 +131,15 @@ def get_subsegments_below(edge_attrs: dict[str, Any]) -> int:
     Returns:
         int: Number of subsegments below the artery segment.
     """
-    subsegments_below = []
-
-    def _dfs(edge: dict[str, Any]) -> int:
-        """Recursive function to count segments below."""
-        level = edge.get("level", 0)
-        if level <= 4:
-            subsegments_below.append(edge.get("segments_below", 0))
+    subsegments_below = 0
+    stack = [edge_attrs]
+    while stack:
+        edge = stack.pop()
+        if edge.get("level", 0) <= 4:
+            subsegments_below += edge.get("segments_below", 0)
         else:
-            for succ in edge.get("successors", []):
-                _dfs(succ)
-
-    _dfs(edge_attrs)
-    return sum(subsegments_below) if subsegments_below else 0
+            stack.extend(edge.get("successors", []))
+    return subsegments_below
 
 
 def compute_qanadli_score(
@@ -132,9 +155,16 @@ def compute_qanadli_score(
 
     Returns:
         float: The Qanadli score, a float between 0 and 1.
+
+    Raises:
+        ValueError: If `weights` and `degrees` have different lengths.
     """
-    degrees = [
-        0 if degree < min_obstruction_thresh else 1 if degree < max_obstruction_thresh else 2 for degree in degrees
-    ]
-    weighted_degrees = [weight * degree for weight, degree in zip(weights, degrees, strict=False)]
-    return sum(weighted_degrees) / (2 * sum(weights))
+    obstructions = np.asarray(degrees, dtype=np.float64)
+    # Float weights keep the values of non-integer weights, and are exact for integer ones
+    weights_array = np.asarray(weights, dtype=np.float64)
+    if weights_array.shape != obstructions.shape:
+        raise ValueError(f"Got {len(weights_array)} weights for {len(obstructions)} degrees, expected one per degree.")
+    scored_degrees = np.where(
+        obstructions < min_obstruction_thresh, 0, np.where(obstructions < max_obstruction_thresh, 1, 2)
+    )
+    return float(weights_array @ scored_degrees) / (2 * float(weights_array.sum()))
@@ -1,9 +1,30 @@
+from __future__ import annotations
+
+import hashlib
+import importlib.metadata
+import tempfile
+import threading
 import webbrowser
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from contextlib import suppress
+from functools import cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import TYPE_CHECKING
 
 import networkx as nx
-from matplotlib.colors import LinearSegmentedColormap, Normalize
-from pyvis.network import Network
+import numpy as np
+
+from tree import CACHE_DIR, touch_cache_file, write_cache_file
+
+if TYPE_CHECKING:
+    from matplotlib.colors import LinearSegmentedColormap, Normalize
+    from pyvis.network import Network
+
+# Bump when the rendered HTML changes for the same inputs, so that cached visualizations are rendered again
+HTML_RENDER_VERSION = 1
+
+# Font of the debug labels displayed above the annotated edges
+DEBUG_LABEL_FONT = {"size": 33, "color": "#ffffff", "strokeWidth": 0, "align": "top", "vadjust": -50}
 
 
 def visualize_attribute_graph_pyvis(
@@ -19,7 +40,9 @@ def visualize_attribute_graph_pyvis(
     max_edge_width: float = 30.0,
     debug_edges: list[tuple] | None = None,
     debug_labels: list[str] | None = None,
-) -> None:
+    use_cache: bool = True,
+    output_path: Path | None = None,
+) -> Path | None:
     """Visualizes a directed graph with attribute values using PyVis.
 
     Creates a temporary HTTP server to render the graph visualization in a web browser.
@@ -41,19 +64,13 @@ def visualize_attribute_graph_pyvis(
         max_edge_width: Maximum edge width for lowest levels.
         debug_edges: List of edge tuples (u, v) to annotate with labels.
         debug_labels: List of debug label strings corresponding to `debug_edges`.
+        use_cache: Whether to reuse the HTML rendered for identical inputs, stored under `CACHE_DIR`.
+        output_path: File path where to save the HTML page instead of opening it in the browser, e.g. for batch use.
 
     Returns:
-        None. Opens the visualization in the default web browser.
+        `output_path` if given, in which case no browser is opened. Otherwise None, the visualization is opened in the
+        default web browser.
     """
-    net = _create_network(height, width, bgcolor, font_color)
-
-    if use_hierarchical:
-        _configure_hierarchical_layout(net)
-
-    _add_nodes(net, graph)
-
-    obs_norm, lvl_norm, cmap = _prepare_color_and_level_normalizers(graph, obstruction_attr, level_attr)
-
     # build debug map if annotations provided
     debug_map: dict[tuple, str] = {}
     if debug_edges is not None or debug_labels is not None:
@@ -61,19 +78,96 @@ def visualize_attribute_graph_pyvis(
             raise ValueError("`debug_edges` and `debug_labels` must both be provided and of equal length.")
         debug_map = dict(zip(debug_edges, debug_labels, strict=False))
 
-    _add_edges(
-        net,
-        graph,
-        obstruction_attr,
-        level_attr,
-        obs_norm,
-        lvl_norm,
-        cmap,
-        min_edge_width,
-        max_edge_width,
-        debug_map,
+    html_bytes = None
+    if use_cache:
+        options = (use_hierarchical, height, width, bgcolor, font_color, min_edge_width, max_edge_width)
+        key = _visualization_key(graph, obstruction_attr, level_attr, options, debug_map)
+        cache_path = CACHE_DIR / "html" / f"{key}.html"
+        with suppress(OSError):
+            html_bytes = cache_path.read_bytes()
+            touch_cache_file(cache_path)
+
+    if html_bytes is None:
+        net = _create_network(height, width, bgcolor, font_color)
+
+        if use_hierarchical:
+            _configure_hierarchical_layout(net)
+
+        _add_nodes(net, graph)
+
+        # Edge values are collected once, for both the normalizers and the edge styles
+        # Read from the raw adjacency dicts, in the same order as `graph.edges(data=True)`
+        edges = [(u, v, data) for u, nbrs in graph._succ.items() for v, data in nbrs.items()]
+        obs_vals = np.array([data.get(obstruction_attr, 0.0) for _, _, data in edges], dtype=float)
+        lvl_vals = [data.get(level_attr, 0.0) for _, _, data in edges]
+        obs_norm, lvl_norm, cmap = _prepare_color_and_level_normalizers(obs_vals, np.array(lvl_vals, dtype=float))
+
+        _add_edges(
+            net,
+            edges,
+            obs_vals,
+            lvl_vals,
+            obstruction_attr,
+            level_attr,
+            obs_norm,
+            lvl_norm,
+            cmap,
+            min_edge_width,
+            max_edge_width,
+            debug_map,
+        )
+        html_bytes = net.generate_html().encode("utf-8")
+        if use_cache:
+            write_cache_file(html_bytes, cache_path)
+
+    if output_path is not None:
+        output_path = Path(output_path)
+        output_path.parent.mkdir(exist_ok=True, parents=True)
+        output_path.write_bytes(html_bytes)
+        return output_path
+
+    _serve_html(html_bytes)
+    return None
+
+
+def _visualization_key(
+    graph: nx.DiGraph,
+    obstruction_attr: str,
+    level_attr: str,
+    options: tuple,
+    debug_map: dict[tuple, str],
+) -> str:
+    """Hash everything the rendered visualization depends on, including the rendering code versions.
+
+    Args:
+        graph: A NetworkX directed graph to visualize.
+        obstruction_attr: The edge attribute name containing attribute values.
+        level_attr: The edge attribute name containing level values.
+        options: Layout and style options of the visualization.
+        debug_map: Mapping from edge (u, v) tuples to debug label strings.
+
+    Returns:
+        Hexadecimal digest identifying the rendered HTML.
+    """
+    edges = [
+        (u, v, data.get(obstruction_attr, 0.0), data.get(level_attr, 0.0))
+        for u, nbrs in graph._succ.items()
+        for v, data in nbrs.items()
+    ]
+    versions = (HTML_RENDER_VERSION, _pyvis_version())
+    content = repr(
+        (versions, list(graph.nodes()), edges, obstruction_attr, level_attr, options, list(debug_map.items()))
     )
-    _serve_network(net)
+    return hashlib.blake2b(content.encode("utf-8"), digest_size=16).hexdigest()
+
+
+@cache
+def _pyvis_version() -> str | None:
+    """Return the installed PyVis version, read from the package metadata so that cache hits do not import PyVis."""
+    try:
+        return importlib.metadata.version("pyvis")
+    except importlib.metadata.PackageNotFoundError:
+        return None
 
 
 def _create_network(
@@ -93,6 +187,8 @@ def _create_network(
     Returns:
         A configured PyVis Network instance.
     """
+    from pyvis.network import Network
+
     net = Network(
         height=height,
         width=width,
@@ -129,25 +225,28 @@ def _configure_hierarchical_layout(net: Network) -> None:
 def _add_nodes(net: Network, graph: nx.DiGraph) -> None:
     """Add nodes from a NetworkX graph to the PyVis Network.
 
+    The node records are assigned in one go, in the format `net.add_node` would build them, as the per-call checks of
+    PyVis scan every node already added.
+
     Args:
         net: The PyVis Network to which nodes will be added.
         graph: A NetworkX directed graph.
     """
-    for n in graph.nodes():
-        net.add_node(n, label=str(n))
+    font = {"font": {"color": net.font_color}} if net.font_color else {}
+    net.nodes = [{"color": "#97c2fc", "id": n, "label": str(n), "shape": "dot", **font} for n in graph.nodes()]
+    net.node_ids = list(graph.nodes())
+    net.node_map = {node["id"]: node for node in net.nodes}
 
 
 def _prepare_color_and_level_normalizers(
-    graph: nx.DiGraph,
-    obstruction_attr: str,
-    level_attr: str,
+    obs_vals: np.ndarray,
+    lvl_vals: np.ndarray,
 ) -> tuple[Normalize, Normalize, LinearSegmentedColormap]:
     """Compute normalizers and colormap for edge coloring and sizing.
 
     Args:
-        graph: A NetworkX directed graph.
-        obstruction_attr: The edge attribute name containing obstruction values.
-        level_attr: The edge attribute name containing level values.
+        obs_vals: Obstruction values of the edges.
+        lvl_vals: Level values of the edges.
 
     Returns:
         A tuple (obs_norm, lvl_norm, cmap) where:
@@ -155,18 +254,42 @@ def _prepare_color_and_level_normalizers(
             lvl_norm: Normalize instance for level values.
             cmap: Colormap for obstruction-to-color mapping.
     """
-    obs_vals = [data.get(obstruction_attr, 0.0) for _, _, data in graph.edges(data=True)]
-    obs_norm = Normalize(vmin=min(obs_vals, default=0.0), vmax=max(obs_vals, default=1.0) or 1.0)
-    cmap = LinearSegmentedColormap.from_list("bpr", ["#aaaaff", "#ff00ff", "#ff0000"])
+    from matplotlib.colors import Normalize
+
+    obs_norm = Normalize(vmin=_min_or(obs_vals, 0.0), vmax=_max_or(obs_vals, 1.0) or 1.0)
+    cmap = _obstruction_colormap()
 
-    lvl_vals = [data.get(level_attr, 0.0) for _, _, data in graph.edges(data=True)]
-    lvl_norm = Normalize(vmin=min(lvl_vals, default=0.0), vmax=max(lvl_vals, default=1.0) or 1.0)
+    lvl_norm = Normalize(vmin=_min_or(lvl_vals, 0.0), vmax=_max_or(lvl_vals, 1.0) or 1.0)
     return obs_norm, lvl_norm, cmap
 
 
+@cache
+def _obstruction_colormap() -> LinearSegmentedColormap:
+    """Build the colormap of the edge obstruction values, once per process.
+
+    Returns:
+        The blue-purple-red colormap, whose lookup table is kept across visualizations.
+    """
+    from matplotlib.colors import LinearSegmentedColormap
+
+    return LinearSegmentedColormap.from_list("bpr", ["#aaaaff", "#ff00ff", "#ff0000"])
+
+
+def _min_or(values: np.ndarray, default: float) -> float:
+    """Return the minimum of `values`, or `default` if there are none."""
+    return float(values.min()) if values.size else default
+
+
+def _max_or(values: np.ndarray, default: float) -> float:
+    """Return the maximum of `values`, or `default` if there are none."""
+    return float(values.max()) if values.size else default
+
+
 def _add_edges(
     net: Network,
-    graph: nx.DiGraph,
+    edges: list[tuple],
+    obs_vals: np.ndarray,
+    lvl_vals: list,
     obstruction_attr: str,
     level_attr: str,
     obs_norm: Normalize,
@@ -180,10 +303,13 @@ def _add_edges(
 
     Edge colors are based on obstruction values and widths inversely on level values.
     Optional debug labels can be displayed on specified edges.
+    The edge records are assigned in one go, in the format `net.add_edge` would build them.
 
     Args:
         net: The PyVis Network to which edges will be added.
-        graph: A NetworkX directed graph.
+        edges: Edges of the graph as (u, v, data) tuples.
+        obs_vals: Obstruction values of `edges`.
+        lvl_vals: Level values of `edges`, as shown in the edge titles.
         obstruction_attr: The edge attribute name containing obstruction values.
         level_attr: The edge attribute name containing level values.
         obs_norm: Normalizer for obstruction values.
@@ -194,49 +320,66 @@ def _add_edges(
         debug_map: Optional mapping from edge (u, v) tuples to debug label strings.
     """
     debug_map = debug_map or {}
-    for u, v, data in graph.edges(data=True):
-        obs = data.get(obstruction_attr, 0.0)
-        r, g, b, _ = cmap(obs_norm(obs))
-        color = f"rgb({int(255 * r)},{int(255 * g)},{int(255 * b)})"
-
-        lvl = data.get(level_attr, 0.0)
-        inv = 1.0 - lvl_norm(lvl)
-        width = min_edge_width + (max_edge_width - min_edge_width) * inv
-
-        edge_kwargs = {
-            "color": color,
-            "width": width,
-            "title": f"{obstruction_attr}: {obs:.2f} | {level_attr}: {lvl}",
-            "arrows": "to",
-        }
+    # Map all edges through the colormap and normalizers at once
+    rgb = (255 * cmap(obs_norm(obs_vals))[:, :3]).astype(int).tolist()
+    inv = 1.0 - lvl_norm(np.asarray(lvl_vals, dtype=float))
+    widths = (min_edge_width + (max_edge_width - min_edge_width) * inv).tolist()
+    colors = [f"rgb({r},{g},{b})" for r, g, b in rgb]
+    titles = [
+        f"{obstruction_attr}: {obs:.2f} | {level_attr}: {lvl}"
+        for obs, lvl in zip(obs_vals.tolist(), lvl_vals, strict=True)
+    ]
+
+    net_edges = []
+    for (u, v, _), color, width, title in zip(edges, colors, widths, titles, strict=True):
+        edge_options = {"color": color, "width": width, "title": title, "arrows": "to"}
         if (u, v) in debug_map:
-            edge_kwargs["label"] = debug_map[(u, v)]
-            if (u, v) in debug_map:
-                edge_kwargs["label"] = debug_map[(u, v)]
-                edge_kwargs["font"] = {"size": 33, "color": "#ffffff", "strokeWidth": 0, "align": "top", "vadjust": -50}
-        net.add_edge(u, v, **edge_kwargs)
+            edge_options["label"] = debug_map[(u, v)]
+            edge_options["font"] = dict(DEBUG_LABEL_FONT)
+        edge_options["from"] = u
+        edge_options["to"] = v
+        net_edges.append(edge_options)
+    net.edges = net_edges
 
 
-def _serve_network(net: Network) -> None:
+def _serve_html(html_bytes: bytes) -> None:
     """Serve the generated PyVis HTML on a temporary local HTTP server and open it.
 
+    Connections are handled in threads until the page has been sent once, so that speculative connections opened by the
+    browser without sending a request, or requests such as the favicon, do not hold up the page. The page is written
+    to a temporary file and sent from it with `socket.sendfile`, which copies it to the socket within the kernel where
+    supported.
+
     Args:
-        net: The PyVis Network to serve.
+        html_bytes: The UTF-8 encoded HTML page to serve.
     """
-    html_bytes = net.generate_html().encode("utf-8")
+    page_sent = threading.Event()
+    # The file position is shared between threads when `sendfile` falls back to reading the file
+    page_lock = threading.Lock()
 
     class _Handler(BaseHTTPRequestHandler):
+        timeout = 10  # drop idle connections
+
         def do_GET(self) -> None:  # noqa: N802
+            if self.path == "/favicon.ico":
+                self.send_error(404)
+                return
             self.send_response(200)
             self.send_header("Content-Type", "text/html; charset=utf-8")
             self.send_header("Content-Length", str(len(html_bytes)))
             self.end_headers()
-            self.wfile.write(html_bytes)
+            with page_lock:
+                self.connection.sendfile(page_file, offset=0, count=len(html_bytes))
+            page_sent.set()
 
         def log_message(self, *args) -> None:
             pass  # silence access logs
 
-    server = HTTPServer(("127.0.0.1", 0), _Handler)
-    host, port = server.server_address
-    webbrowser.open(f"http://{host}:{port}")
-    server.handle_request()
+    with tempfile.TemporaryFile() as page_file, ThreadingHTTPServer(("127.0.0.1", 0), _Handler) as server:
+        page_file.write(html_bytes)
+        page_file.flush()
+        server.timeout = 0.5  # check regularly whether the page was sent
+        host, port = server.server_address
+        webbrowser.open(f"http://{host}:{port}")
+        while not page_sent.is_set():
+            server.handle_request()
@@ -1,31 +1,37 @@
 import os
 import sys
+from collections.abc import Iterable
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from pathlib import Path
 
 import click
 
-from commands import (
-    compute_mastora,
-    compute_qanadli,
-    visualize_attribute_graph_pyvis,
-)
-from commands.correlate import correlate_and_plot
-from tree import add_max_attribute_values, directed_graph_to_json, json_to_directed_graph
+from graphscore.paths import get_full_file_path, get_graphs_dir
 
+# Command dependencies are imported inside each command to keep `--help` and argument errors fast
 
-@click.command()
-@click.argument(
+# Arguments and options shared by several commands
+input_file_argument = click.argument(
     "input_file",
     type=str,
 )
-@click.option(
+obstruction_attr_option = click.option(
+    "--obstruction-attr",
+    "-o",
+    type=str,
+    default="max_transversal_obstruction",
+    show_default=True,
+    help="The edge attribute to use for obstruction values.",
+)
+use_percentage_option = click.option(
     "--use-percentage",
     "-p",
     is_flag=True,
     default=False,
     help="If set, treat degrees as obstruction percentages (0 to 1). Otherwise, use degrees (0 to 5).",
 )
-@click.option(
+mode_option = click.option(
     "--mode",
     "-m",
     type=str,
@@ -33,14 +39,42 @@ from tree import add_max_attribute_values, directed_graph_to_json, json_to_direc
     show_default=True,
     help="Artery levels to include: 'm' (mediastinal), 'l' (lobar), 's' (segmental). Any combination (e.g., 'mls').",
 )
-@click.option(
-    "--obstruction-attr",
-    "-o",
-    type=str,
-    default="max_transversal_obstruction",
+min_obstruction_thresh_option = click.option(
+    "--min-obstruction-thresh",
+    "-n",
+    type=float,
+    default=0.25,
     show_default=True,
-    help="The edge attribute to use for obstruction values.",
+    help="Minimum obstruction threshold for considering a segment.",
+)
+max_obstruction_thresh_option = click.option(
+    "--max-obstruction-thresh",
+    "-x",
+    type=float,
+    default=0.75,
+    show_default=True,
+    help="Maximum obstruction threshold for considering a segment.",
+)
+no_cache_option = click.option(
+    "--no-cache",
+    is_flag=True,
+    default=False,
+    help="If set, neither read nor write the attribute graphs and visualizations cached on disk.",
 )
+
+
+def _validate_jobs(ctx: click.Context, param: click.Parameter, value: int) -> int:
+    """Check a number of worker processes, a positive count or -1 for all CPU cores."""
+    if value == 0 or value < -1:
+        raise click.BadParameter("must be a positive number of processes, or -1 for all CPU cores.")
+    return value
+
+
+@click.command()
+@input_file_argument
+@use_percentage_option
+@mode_option
+@obstruction_attr_option
 @click.option(
     "--debug",
     "-d",
@@ -48,7 +82,10 @@ from tree import add_max_attribute_values, directed_graph_to_json, json_to_direc
     default=False,
     help="If set, show a debug visualization of the Mastora calculation.",
 )
-def mastora(input_file: str, use_percentage: bool, mode: str, obstruction_attr: str, debug: bool) -> None:
+@no_cache_option
+def mastora(
+    input_file: str, use_percentage: bool, mode: str, obstruction_attr: str, debug: bool, no_cache: bool
+) -> None:
     """Compute Mastora score from a graph JSON file.
 
     Calculates the Mastora score for pulmonary embolism risk assessment, which evaluates
@@ -56,10 +93,12 @@ def mastora(input_file: str, use_percentage: bool, mode: str, obstruction_attr:
 
     INPUT_FILE: Input JSON graph, indicate full file path or only patient ID (e.g., 0055).
     """
+    from commands import compute_mastora
+    from tree import load_attribute_graph
+
     input_file_path = get_full_file_path(Path(input_file))
     click.echo(f"Loading graph from {input_file_path}")
-    graph = json_to_directed_graph(input_file_path)
-    new_graph = add_max_attribute_values(graph)
+    new_graph = load_attribute_graph(input_file_path, use_cache=not no_cache)
     click.echo("Computing Mastora score...")
 
     if debug:
@@ -68,8 +107,14 @@ def mastora(input_file: str, use_percentage: bool, mode: str, obstruction_attr:
         )
         click.echo(f"Mastora score: {score}")
         click.echo("Creating interactive visualization with debug information...")
+        from commands import visualize_attribute_graph_pyvis
+
         visualize_attribute_graph_pyvis(
-            new_graph, obstruction_attr=obstruction_attr, debug_edges=debug_edges, debug_labels=debug_labels
+            new_graph,
+            obstruction_attr=obstruction_attr,
+            debug_edges=debug_edges,
+            debug_labels=debug_labels,
+            use_cache=not no_cache,
         )
         click.echo("Visualization created. Open the browser to view it.")
     else:
@@ -78,34 +123,10 @@ def mastora(input_file: str, use_percentage: bool, mode: str, obstruction_attr:
 
 
 @click.command()
-@click.argument(
-    "input_file",
-    type=str,
-)
-@click.option(
-    "--min-obstruction-thresh",
-    "-n",
-    type=float,
-    default=0.25,
-    show_default=True,
-    help="Minimum obstruction threshold for considering a segment.",
-)
-@click.option(
-    "--max-obstruction-thresh",
-    "-x",
-    type=float,
-    default=0.75,
-    show_default=True,
-    help="Maximum obstruction threshold for considering a segment.",
-)
-@click.option(
-    "--obstruction-attr",
-    "-o",
-    type=str,
-    default="max_transversal_obstruction",
-    show_default=True,
-    help="The edge attribute to use for obstruction values.",
-)
+@input_file_argument
+@min_obstruction_thresh_option
+@max_obstruction_thresh_option
+@obstruction_attr_option
 @click.option(
     "--debug",
     "-d",
@@ -113,8 +134,14 @@ def mastora(input_file: str, use_percentage: bool, mode: str, obstruction_attr:
     default=False,
     help="If set, show a debug visualization of the Qanadli calculation.",
 )
+@no_cache_option
 def qanadli(
-    input_file: str, min_obstruction_thresh: float, max_obstruction_thresh: float, obstruction_attr: str, debug: bool
+    input_file: str,
+    min_obstruction_thresh: float,
+    max_obstruction_thresh: float,
+    obstruction_attr: str,
+    debug: bool,
+    no_cache: bool,
 ) -> None:
     """Compute Qanadli score from a graph JSON file.
 
@@ -124,10 +151,12 @@ def qanadli(
 
     INPUT_FILE: Input JSON graph, indicate full file path or only patient ID (e.g., 0055).
     """
+    from commands import compute_qanadli
+    from tree import load_attribute_graph
+
     input_file_path = get_full_file_path(Path(input_file))
     click.echo(f"Loading graph from {input_file_path}")
-    graph = json_to_directed_graph(input_file_path)
-    new_graph = add_max_attribute_values(graph)
+    new_graph = load_attribute_graph(input_file_path, use_cache=not no_cache)
     click.echo("Computing Qanadli score...")
 
     if debug:
@@ -140,8 +169,14 @@ def qanadli(
         )
         click.echo(f"Qanadli score: {score}")
         click.echo("Creating interactive visualization with debug information...")
+        from commands import visualize_attribute_graph_pyvis
+
         visualize_attribute_graph_pyvis(
-            new_graph, obstruction_attr=obstruction_attr, debug_edges=debug_edges, debug_labels=debug_labels
+            new_graph,
+            obstruction_attr=obstruction_attr,
+            debug_edges=debug_edges,
+            debug_labels=debug_labels,
+            use_cache=not no_cache,
         )
         click.echo("Visualization created. Open the browser to view it.")
     else:
@@ -155,58 +190,99 @@ def qanadli(
 
 
 @click.command()
-@click.argument(
-    "input_file",
-    type=str,
-)
+@input_file_argument
 @click.option(
-    "--obstruction-attr",
-    "-o",
-    type=str,
-    default="max_transversal_obstruction",
+    "--scores",
+    "-s",
+    type=click.Choice(["mastora", "qanadli"], case_sensitive=False),
+    multiple=True,
+    default=["mastora", "qanadli"],
     show_default=True,
-    help="The edge attribute to use for obstruction values.",
+    help="Scores to compute, repeat the option to compute several.",
 )
-def visualize(input_file: str, obstruction_attr: str) -> None:
-    """Visualize attribute values from a graph JSON file using PyVis network visualization.
+@use_percentage_option
+@mode_option
+@min_obstruction_thresh_option
+@max_obstruction_thresh_option
+@obstruction_attr_option
+@no_cache_option
+def score(
+    input_file: str,
+    scores: tuple[str, ...],
+    use_percentage: bool,
+    mode: str,
+    min_obstruction_thresh: float,
+    max_obstruction_thresh: float,
+    obstruction_attr: str,
+    no_cache: bool,
+) -> None:
+    """Compute several scores from a graph JSON file, loading it only once.
 
-    Creates an interactive network visualization of the arterial tree with edges colored
-    based on attribute values. The visualization is displayed in a web browser.
+    Equivalent to running `mastora` and `qanadli` on the same input, without parsing the graph and computing its
+    attribute values for each of them.
 
     INPUT_FILE: Input JSON graph, indicate full file path or only patient ID (e.g., 0055).
     """
+    from commands import compute_mastora, compute_qanadli
+    from tree import load_attribute_graph
+
     input_file_path = get_full_file_path(Path(input_file))
     click.echo(f"Loading graph from {input_file_path}")
-    graph = json_to_directed_graph(input_file_path)
-    click.echo("Computing attribute values...")
-    new_graph = add_max_attribute_values(graph)
-    click.echo("Creating interactive visualization...")
-    visualize_attribute_graph_pyvis(new_graph, obstruction_attr=obstruction_attr)
-    click.echo("Visualization created. Open the browser to view it.")
+    new_graph = load_attribute_graph(input_file_path, use_cache=not no_cache)
+
+    for score_name in dict.fromkeys(name.lower() for name in scores):
+        if score_name == "mastora":
+            value = compute_mastora(
+                new_graph, use_percentage=use_percentage, mode=mode, obstruction_attr=obstruction_attr
+            )
+            click.echo(f"Mastora score: {value}")
+        else:
+            value = compute_qanadli(
+                new_graph,
+                min_obstruction_thresh=min_obstruction_thresh,
+                max_obstruction_thresh=max_obstruction_thresh,
+                obstruction_attr=obstruction_attr,
+            )
+            click.echo(f"Qanadli score: {value}")
+
 
+@click.command()
+@input_file_argument
+@obstruction_attr_option
+@click.option(
+    "--output-file",
+    "-f",
+    type=str,
+    default=None,
+    help="Save the visualization to this HTML file instead of opening it in the browser.",
+)
+@no_cache_option
+def visualize(input_file: str, obstruction_attr: str, output_file: str | None, no_cache: bool) -> None:
+    """Visualize attribute values from a graph JSON file using PyVis network visualization.
 
-def get_full_file_path(input_file: Path) -> Path:
-    """Get full file path for the input file.
+    Creates an interactive network visualization of the arterial tree with edges colored
+    based on attribute values. The visualization is displayed in a web browser, or saved
+    to an HTML file with `--output-file`.
 
-    Resolves either a direct file path or a patient ID to a complete file path. If a patient ID is provided, it is zero-
-    padded to 4 digits and resolved to the standard file naming convention in the data/graphs directory.
+    INPUT_FILE: Input JSON graph, indicate full file path or only patient ID (e.g., 0055).
     """
-    if input_file.is_file():
-        return input_file
-    # Assuming the input is a patient ID, construct the path with a 4-digit format
-    patient_id = input_file.stem.zfill(4)
-    constructed_path = Path(f"../data/graphs/{patient_id}_graph_ep_transversal_obstruction.json")
-
-    # Check if the constructed path exists
-    if constructed_path.is_file():
-        return constructed_path
-    # Try with current directory as well
-    alt_path = Path(f"data/graphs/{patient_id}_graph_ep_transversal_obstruction.json")
-    if alt_path.is_file():
-        return alt_path
-    raise FileNotFoundError(
-        f"Could not find file for patient ID '{patient_id}'. Tried: {constructed_path} and {alt_path}"
+    from commands import visualize_attribute_graph_pyvis
+    from tree import load_attribute_graph
+
+    input_file_path = get_full_file_path(Path(input_file))
+    click.echo(f"Loading graph from {input_file_path}")
+    new_graph = load_attribute_graph(input_file_path, use_cache=not no_cache)
+    click.echo("Creating interactive visualization...")
+    output_path = visualize_attribute_graph_pyvis(
+        new_graph,
+        obstruction_attr=obstruction_attr,
+        use_cache=not no_cache,
+        output_path=Path(output_file) if output_file else None,
     )
+    if output_path is not None:
+        click.echo(f"Visualization saved to {output_path}")
+    else:
+        click.echo("Visualization created. Open the browser to view it.")
 
 
 @click.command()
@@ -223,7 +299,19 @@ def get_full_file_path(input_file: Path) -> Path:
     show_default=True,
     help="Directory where to save the attribute graph files.",
 )
-def generate_attribute(input_file: str | None = None, output_dir: str = "data/attribute_graphs/") -> None:
+@click.option(
+    "--jobs",
+    "-j",
+    type=int,
+    default=1,
+    show_default=True,
+    callback=_validate_jobs,
+    help="Number of worker processes used when processing all graphs. Use -1 for all CPU cores.",
+)
+@no_cache_option
+def generate_attribute(
+    input_file: str | None = None, output_dir: str = "data/attribute_graphs/", jobs: int = 1, no_cache: bool = False
+) -> None:
     """Generate attribute-enhanced graph from a JSON file and save it.
 
     Takes an arterial tree graph, processes it to add computed attribute values,
@@ -236,38 +324,66 @@ def generate_attribute(input_file: str | None = None, output_dir: str = "data/at
 
     # Process all graphs if no input file is specified
     if input_file is None:
-        graphs_dir = Path("data/graphs/")
-        if not graphs_dir.exists():
-            graphs_dir = Path("../data/graphs/")
-            if not graphs_dir.exists():
-                raise FileNotFoundError("Could not find graphs directory at data/graphs/ or ../data/graphs/")
-
-        graph_files = list(graphs_dir.glob("*.json"))
+        graphs_dir = get_graphs_dir()
+        with os.scandir(graphs_dir) as entries:
+            graph_files = sorted(
+                graphs_dir / entry.name for entry in entries if entry.name.endswith(".json") and entry.is_file()
+            )
         if not graph_files:
             click.echo(f"No graph files found in {graphs_dir}")
             return
 
         click.echo(f"Found {len(graph_files)} graph files to process")
-        for graph_file in graph_files:
-            process_single_graph(graph_file, output_dir_path)
+        # Graphs are processed silently, a single progress bar reports them as results come back in order
+        args = (graph_files, repeat(output_dir_path), repeat(False), repeat(not no_cache))
+        if jobs == 1:
+            _show_progress(map(process_single_graph, *args), len(graph_files))
+        else:
+            with ProcessPoolExecutor(max_workers=None if jobs == -1 else jobs) as executor:
+                _show_progress(executor.map(process_single_graph, *args), len(graph_files))
         click.echo(f"All graphs processed and saved to {output_dir_path}")
     else:
         # Process a single graph
         input_file_path = get_full_file_path(Path(input_file))
-        process_single_graph(input_file_path, output_dir_path)
+        process_single_graph(input_file_path, output_dir_path, use_cache=not no_cache)
 
 
-def process_single_graph(input_file_path: Path, output_dir_path: Path) -> None:
+def _show_progress(output_paths: Iterable[Path], length: int) -> None:
+    """Consume saved graph paths while displaying a progress bar.
+
+    Args:
+        output_paths: Paths of the saved attribute graphs, produced as graphs are processed
+        length: Number of graphs to process
+    """
+    with click.progressbar(
+        output_paths,
+        length=length,
+        label="Processing graphs",
+        item_show_func=lambda output_path: output_path.name if output_path else None,
+    ) as progress:
+        for _ in progress:
+            pass
+
+
+def process_single_graph(
+    input_file_path: Path, output_dir_path: Path, verbose: bool = True, use_cache: bool = True
+) -> Path:
     """Process a single graph file, adding attribute computations and saving the result.
 
     Args:
         input_file_path: Path to the input graph file
         output_dir_path: Directory where to save the output
+        verbose: If True, report progress with `click.echo`
+        use_cache: If True, reuse the attribute graph cached on disk, see `load_attribute_graph`
+
+    Returns:
+        Path of the saved attribute graph
     """
-    click.echo(f"Loading graph from {input_file_path}")
-    graph = json_to_directed_graph(input_file_path)
-    click.echo("Computing attribute values...")
-    new_graph = add_max_attribute_values(graph)
+    from tree import directed_graph_to_json, load_attribute_graph
+
+    if verbose:
+        click.echo(f"Loading graph from {input_file_path}")
+    new_graph = load_attribute_graph(input_file_path, use_cache=use_cache)
 
     # Generate output filename
     output_filename = f"{input_file_path.stem}_obs_attr.json"
@@ -275,7 +391,9 @@ def process_single_graph(input_file_path: Path, output_dir_path: Path) -> None:
 
     # Save graph to JSON file
     directed_graph_to_json(new_graph, output_path)
-    click.echo(f"Attribute graph saved to {output_path}")
+    if verbose:
+        click.echo(f"Attribute graph saved to {output_path}")
+    return output_path
 
 
 @click.command()
@@ -305,14 +423,7 @@ def process_single_graph(input_file_path: Path, output_dir_path: Path) -> None:
     show_default=True,
     help="Path to the directory containing graph JSON files.",
 )
-@click.option(
-    "--obstruction-attr",
-    "-o",
-    type=str,
-    default="max_transversal_obstruction",
-    show_default=True,
-    help="The edge attribute to use for obstruction values.",
-)
+@obstruction_attr_option
 @click.option(
     "--all-attributes",
     "-a",
@@ -327,6 +438,16 @@ def process_single_graph(input_file_path: Path, output_dir_path: Path) -> None:
     default=False,
     help="Show the correlation plot visualization in browser.",
 )
+@click.option(
+    "--jobs",
+    "-j",
+    type=int,
+    default=1,
+    show_default=True,
+    callback=_validate_jobs,
+    help="Number of worker processes used to score the patient graphs. Use -1 for all CPU cores.",
+)
+@no_cache_option
 def correlate(
     score_name: str,
     attribute_name: str,
@@ -335,8 +456,12 @@ def correlate(
     obstruction_attr: str,
     all_attributes: bool,
     show_visualization: bool,
+    jobs: int,
+    no_cache: bool,
 ) -> None:
     """Correlate graph scores with clinical attributes and visualize the results."""
+    from commands.correlate import correlate_and_plot
+
     script = os.path.basename(sys.argv[0])
     cli_command = " ".join([script] + sys.argv[1:])
     correlate_and_plot(
@@ -348,4 +473,6 @@ def correlate(
         cli_command,
         all_attributes,
         show_visualization,
+        jobs,
+        use_cache=not no_cache,
     )
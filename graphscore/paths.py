@@ -0,0 +1,45 @@
+from pathlib import Path
+
+# Directories searched for the patient graph files, relative to the current directory, in order
+# The orders differ on purpose and keep the original lookups when both directories exist: batch commands process
+# the graphs of the current directory, like the `correlate` default of data/graphs/, while a single patient ID
+# resolves to ../data/graphs/ first
+GRAPHS_DIR_CANDIDATES = (Path("data/graphs/"), Path("../data/graphs/"))
+GRAPH_FILE_DIR_CANDIDATES = (Path("../data/graphs/"), Path("data/graphs/"))
+
+
+def get_graphs_dir() -> Path:
+    """Get the directory containing the patient graph files.
+
+    Returns:
+        The first existing directory among `GRAPHS_DIR_CANDIDATES`.
+    """
+    for graphs_dir in GRAPHS_DIR_CANDIDATES:
+        if graphs_dir.is_dir():
+            return graphs_dir
+    raise FileNotFoundError("Could not find graphs directory at data/graphs/ or ../data/graphs/")
+
+
+def get_full_file_path(input_file: Path) -> Path:
+    """Get full file path for the input file.
+
+    Resolves either a direct file path or a patient ID to a complete file path. If a patient ID is provided, it is zero-
+    padded to 4 digits and resolved to the standard file naming convention in the first graphs directory among
+    `GRAPH_FILE_DIR_CANDIDATES` that contains the file.
+    """
+    if input_file.is_file():
+        return input_file
+    # Imported here like the command dependencies, see `graphscore.cli`
+    from tree import GRAPH_FILENAME_TEMPLATE
+
+    # Assuming the input is a patient ID, construct the path with a 4-digit format
+    patient_id = input_file.stem.zfill(4)
+    constructed_paths = [
+        graphs_dir / GRAPH_FILENAME_TEMPLATE.format(patient_id) for graphs_dir in GRAPH_FILE_DIR_CANDIDATES
+    ]
+    for constructed_path in constructed_paths:
+        if constructed_path.is_file():
+            return constructed_path
+    raise FileNotFoundError(
+        f"Could not find file for patient ID '{patient_id}'. Tried: {' and '.join(map(str, constructed_paths))}"
+    )
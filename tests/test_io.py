@@ -0,0 +1,60 @@
+import json
+from pathlib import Path
+
+import networkx as nx
+import pytest
+
+from tree import json_to_directed_graph, load_attribute_graph
+
+# Arborescence 0 -> 1 -> 2, with a parallel edge 0 -> 1 in the multigraph variant
+NODES = [{"id": 0}, {"id": 1}, {"id": 2}]
+LINKS = [
+    {"source": 0, "target": 1, "level": 1, "transversal_obstruction": [0.2]},
+    {"source": 1, "target": 2, "level": 2, "transversal_obstruction": [0.5, 0.1]},
+]
+
+
+def write_graph(path: Path, links: list[dict], multigraph: bool = False, directed: bool = True) -> Path:
+    """Write node-link data of the test graph to a JSON file."""
+    data = {"directed": directed, "multigraph": multigraph, "graph": {}, "nodes": NODES, "links": links}
+    path.write_text(json.dumps(data))
+    return path
+
+
+def test_json_to_directed_graph_matches_node_link_graph(tmp_path: Path) -> None:
+    """A plain directed graph loads with the same nodes, edges and attributes as `nx.node_link_graph`."""
+    json_path = write_graph(tmp_path / "graph.json", LINKS)
+
+    graph = json_to_directed_graph(json_path)
+    expected = nx.node_link_graph(json.loads(json_path.read_text()), directed=True, edges="links")
+
+    assert type(graph) is nx.DiGraph
+    assert list(graph.nodes(data=True)) == list(expected.nodes(data=True))
+    assert list(graph.edges(data=True)) == list(expected.edges(data=True))
+
+
+@pytest.mark.parametrize(("multigraph", "directed"), [(True, True), (False, False)])
+def test_json_to_directed_graph_converts_to_digraph(tmp_path: Path, multigraph: bool, directed: bool) -> None:
+    """Multigraph and undirected data load as a `DiGraph`, as `nx.DiGraph(nx.node_link_graph(...))` does."""
+    links = [*LINKS, {"source": 0, "target": 1, "level": 1, "transversal_obstruction": [0.4]}] if multigraph else LINKS
+    json_path = write_graph(tmp_path / "graph.json", links, multigraph=multigraph, directed=directed)
+
+    graph = json_to_directed_graph(json_path, validate=False)
+    expected = nx.DiGraph(nx.node_link_graph(json.loads(json_path.read_text()), directed=True, edges="links"))
+
+    assert type(graph) is nx.DiGraph
+    assert list(graph.edges(data=True)) == list(expected.edges(data=True))
+
+
+def test_load_attribute_graph_on_multigraph_data(tmp_path: Path) -> None:
+    """Multigraph data gets the attribute values of its merged `DiGraph`."""
+    parallel_link = {"source": 0, "target": 1, "level": 1, "transversal_obstruction": [0.2]}
+    json_path = write_graph(tmp_path / "graph.json", [*LINKS, parallel_link], multigraph=True)
+
+    graph = load_attribute_graph(json_path, use_cache=False)
+
+    assert type(graph) is nx.DiGraph
+    assert graph.edges[0, 1]["max_transversal_obstruction"] == pytest.approx(0.2)
+    assert graph.edges[1, 2]["max_transversal_obstruction"] == pytest.approx(0.5)
+    assert graph.edges[1, 2]["max_transversal_obstruction_propagated"] == pytest.approx(0.5)
+    assert graph.edges[1, 2]["max_transversal_obstruction_cumulated"] == pytest.approx(0.6)
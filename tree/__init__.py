@@ -1,4 +1,15 @@
+from .cache import CACHE_DIR, touch_cache_file, write_cache_file
 from .graph_attributes import add_max_attribute_values, find_root
-from .io import directed_graph_to_json, json_to_directed_graph
+from .io import GRAPH_FILENAME_TEMPLATE, directed_graph_to_json, json_to_directed_graph, load_attribute_graph
 
-__all__ = ["add_max_attribute_values", "directed_graph_to_json", "find_root", "json_to_directed_graph"]
+__all__ = [
+    "CACHE_DIR",
+    "GRAPH_FILENAME_TEMPLATE",
+    "add_max_attribute_values",
+    "directed_graph_to_json",
+    "find_root",
+    "json_to_directed_graph",
+    "load_attribute_graph",
+    "touch_cache_file",
+    "write_cache_file",
+]
@@ -0,0 +1,107 @@
+import os
+import tempfile
+from contextlib import suppress
+from pathlib import Path
+
+CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "graphscore"
+# Total size of a cache directory, subdirectories included, above which its least recently used files are deleted
+CACHE_MAX_BYTES = 256 * 1024**2
+# Pruning goes below the limit, so that the following writes do not scan the directory again right away
+_PRUNED_FRACTION = 0.75
+
+# Estimated size of each cache directory written by this process, scanned on its first write
+_cache_sizes: dict[Path, int] = {}
+
+
+def write_cache_file(
+    content: bytes, output_path: Path, cache_root: Path = CACHE_DIR, max_bytes: int | None = CACHE_MAX_BYTES
+) -> None:
+    """Writes a cache file atomically, ignoring file system errors.
+
+    The content is written to a temporary file in the same directory and moved into place, so concurrent readers never
+    see a partial file. The size of `cache_root` is scanned on the first write of the process and then estimated from
+    the written files, and the directory is only pruned once the estimate exceeds `max_bytes`, see `prune_cache`.
+
+    Args:
+        content: Bytes to write.
+        output_path: File path where to save the content, inside `cache_root`.
+        cache_root: Cache directory whose total size is bounded. Default to `CACHE_DIR`.
+        max_bytes: Maximum total size of `cache_root`, None for no limit. Default to `CACHE_MAX_BYTES`.
+    """
+    tmp_path = None
+    try:
+        output_path.parent.mkdir(exist_ok=True, parents=True)
+        with tempfile.NamedTemporaryFile(dir=output_path.parent, suffix=".tmp", delete=False) as file:
+            tmp_path = Path(file.name)
+            file.write(content)
+        os.replace(tmp_path, output_path)
+    except OSError:
+        # The cache is optional, e.g. the cache directory may be read-only
+        if tmp_path is not None:
+            tmp_path.unlink(missing_ok=True)
+        return
+    if max_bytes is None:
+        return
+
+    if cache_root in _cache_sizes:
+        _cache_sizes[cache_root] += len(content)
+    else:
+        _cache_sizes[cache_root] = sum(size for _, size, _ in _list_cache_files(cache_root))
+    if _cache_sizes[cache_root] > max_bytes:
+        _cache_sizes[cache_root] = prune_cache(cache_root, int(max_bytes * _PRUNED_FRACTION), keep=output_path)
+
+
+def touch_cache_file(cache_path: Path) -> None:
+    """Marks a cache file as recently used, so that `prune_cache` deletes it last.
+
+    Args:
+        cache_path: Cache file that was just read.
+    """
+    with suppress(OSError):
+        os.utime(cache_path)
+
+
+def prune_cache(cache_root: Path, max_bytes: int, keep: Path | None = None) -> int:
+    """Deletes the least recently used files of a cache directory and its subdirectories until they fit in `max_bytes`.
+
+    Files are ordered by modification time, which `write_cache_file` and `touch_cache_file` update. Errors are ignored,
+    e.g. files already deleted by a concurrent process.
+
+    Args:
+        cache_root: Cache directory to prune.
+        max_bytes: Maximum total size of the files of the directory.
+        keep: File never to delete, e.g. the one just written.
+
+    Returns:
+        The total size of the remaining files.
+    """
+    files = _list_cache_files(cache_root)
+    total_size = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total_size <= max_bytes:
+            break
+        if keep is not None and Path(path) == keep:
+            continue
+        with suppress(OSError):
+            os.unlink(path)
+            total_size -= size
+    return total_size
+
+
+def _list_cache_files(cache_root: Path) -> list[tuple[int, int, str]]:
+    """Lists the files of a cache directory and its subdirectories, skipping the ones that cannot be read.
+
+    Args:
+        cache_root: Cache directory to scan.
+
+    Returns:
+        A (modification time, size, path) tuple for each file.
+    """
+    files = []
+    for dir_path, _, file_names in os.walk(cache_root):
+        for file_name in file_names:
+            path = os.path.join(dir_path, file_name)
+            with suppress(OSError):
+                stat = os.stat(path)
+                files.append((stat.st_mtime_ns, stat.st_size, path))
+    return files
@@ -11,6 +11,7 @@ def add_max_attribute_values(
     max_attr: str = "max_transversal_obstruction",
     propagated_attr: str = "max_transversal_obstruction_propagated",
     cumulated_attr: str = "max_transversal_obstruction_cumulated",
+    inplace: bool = False,
 ) -> nx.DiGraph:
     """Traverse the directed tree and return a copy with computed attribute values on each edge.
 
@@ -31,37 +32,35 @@ def add_max_attribute_values(
             values. Defaults to "max_transversal_obstruction_propagated".
         cumulated_attr (str, optional): Name for the new edge attribute to store cumulated
             values. Defaults to "max_transversal_obstruction_cumulated".
+        inplace (bool, optional): If True, write the attribute values on the edges of `graph` itself instead of a
+            copy, for callers that own the graph. Defaults to False.
 
     Returns:
-        nx.DiGraph: A shallow copy of `graph` where each edge has computed attribute values.
+        nx.DiGraph: A shallow copy of `graph`, or `graph` itself if `inplace`, where each edge has computed attribute
+            values.
 
     Raises:
         ValueError: If `graph` is not a valid arborescence.
     """
-    new_graph = graph.copy()
+    new_graph = graph if inplace else graph.copy()
     if root is None:
         root = find_root(graph)
 
-    def propagate_fn(parent_deg: float, own_deg: float) -> float:
-        """Return new propagated attribute value for the edge based on parent's and own values."""
-        return max(parent_deg, own_deg)
+    # Iterative pre-order traversal, each stack entry holds a node and the values of the edge leading to it
+    succ = new_graph._succ  # raw adjacency dicts, avoid building an AtlasView per node
+    stack = [(root, root_obstruction, root_obstruction)]
+    while stack:
+        node, parent_prop, parent_cum = stack.pop()
+        for child, edge_attrs in succ[node].items():
+            own = max(edge_attrs.get(input_attr, [0.0]))
+            # Propagated value is the maximum along the path, cumulated value combines obstructions as probabilities
+            prop = own if own > parent_prop else parent_prop
+            cum = 1 - (1 - own) * (1 - parent_cum)
+            edge_attrs[max_attr] = own
+            edge_attrs[propagated_attr] = prop
+            edge_attrs[cumulated_attr] = cum
+            stack.append((child, prop, cum))
 
-    def cumulate_fn(parent_deg: float, own_deg: float) -> float:
-        """Return new cumulated attribute value for the edge based on parent's and own values."""
-        return 1 - (1 - own_deg) * (1 - parent_deg)
-
-    def _dfs(node: Any, parent_prop: float, parent_cum: float) -> None:
-        for child in new_graph.successors(node):
-            own = new_graph.edges[node, child].get(input_attr, [0.0])
-            own = max(own)
-            prop = propagate_fn(parent_prop, own)
-            cum = cumulate_fn(parent_cum, own)
-            new_graph.edges[node, child][max_attr] = own
-            new_graph.edges[node, child][propagated_attr] = prop
-            new_graph.edges[node, child][cumulated_attr] = cum
-            _dfs(child, prop, cum)
-
-    _dfs(root, root_obstruction, root_obstruction)
     return new_graph
 
 
@@ -79,7 +78,8 @@ def find_root(graph: nx.DiGraph) -> Any:
         ValueError: If no node with in-degree 0 is found.
         ValueError: If more than one node with in-degree 0 is found.
     """
-    roots = [node for node, deg in graph.in_degree() if deg == 0]
+    # Nodes without predecessors, read from the raw adjacency dicts rather than through an in-degree view
+    roots = [node for node, preds in graph._pred.items() if not preds]
     if not roots:
         raise ValueError("No root found: graph has no node with in-degree 0.")
     if len(roots) > 1:
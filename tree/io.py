@@ -1,31 +1,133 @@
+import hashlib
 import json
+import math
+import pickle
 from pathlib import Path
+from typing import Any
 
 import networkx as nx
 
+from .cache import CACHE_DIR, touch_cache_file, write_cache_file
+from .graph_attributes import add_max_attribute_values
 
-def json_to_directed_graph(json_path: Path, **node_link_graph_kwargs) -> nx.DiGraph:
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# File name of a patient graph, formatted with the zero-padded patient ID
+GRAPH_FILENAME_TEMPLATE = "{}_graph_ep_transversal_obstruction.json"
+# Bump when the pickled attribute graphs change, e.g. new attributes in `add_max_attribute_values`
+ATTRIBUTE_CACHE_VERSION = 1
+
+
+def json_to_directed_graph(
+    json_path: Path, validate: bool = True, edges: str = "links", **node_link_graph_kwargs
+) -> nx.DiGraph:
     """Parses JSON file into a NetworkX `DiGraph`.
 
     Args:
         json_path: File path to read as NetworkX graph.
-        **node_link_graph_kwargs: Keys for serialized attribute names to pass to `nx.node_link_graph`.
+        validate: Whether to check that the graph is an arborescence, skip it for trusted files. Default to True.
+        edges: Key of the edge records, see `nx.node_link_graph`. Default to "links".
+        **node_link_graph_kwargs: Other keys for serialized attribute names, see `nx.node_link_graph`.
 
     Returns:
-        NetworkX `DiGraph` loaded from the JSON file.
+        NetworkX `DiGraph` loaded from the JSON file, undirected and multigraph data being converted to a `DiGraph`.
+
+    Raises:
+        ValueError: If `validate` is True and the graph is not an arborescence.
     """
-    with open(json_path) as file:
-        json_graph = json.load(file)
+    json_graph = _load_json(Path(json_path))
 
-    graph = nx.node_link_graph(
-        json_graph,
-        directed=True,
-        **node_link_graph_kwargs or {"edges": "links"},
-    )
+    graph = _node_link_digraph(json_graph, edges=edges, **node_link_graph_kwargs)
+    del json_graph
 
-    if not nx.is_arborescence(graph):
+    if validate and not nx.is_arborescence(graph):
         raise ValueError("The DiGraph is not an arborescence.")
-    return nx.DiGraph(graph)
+    return graph
+
+
+def _node_link_digraph(data: dict[str, Any], **node_link_graph_kwargs) -> nx.DiGraph:
+    """Builds a `DiGraph` from node-link data, inserting all nodes and then all edges in bulk.
+
+    Directed graphs without parallel edges, the format of the patient graphs, are built like `nx.node_link_graph` does
+    but with one `add_nodes_from` and one `add_edges_from` call. Other data is parsed by `nx.node_link_graph` and
+    converted to a `DiGraph`, parallel edges being merged.
+
+    Args:
+        data: Parsed node-link data.
+        **node_link_graph_kwargs: Keys for serialized attribute names, see `nx.node_link_graph`.
+
+    Returns:
+        NetworkX `DiGraph` built from the data.
+    """
+    if data.get("multigraph", False) or not data.get("directed", True):
+        return nx.DiGraph(nx.node_link_graph(data, directed=True, **node_link_graph_kwargs))
+
+    nodes = node_link_graph_kwargs.get("nodes", "nodes")
+    edges = node_link_graph_kwargs.get("edges", "edges")
+    source = node_link_graph_kwargs.get("source", "source")
+    target = node_link_graph_kwargs.get("target", "target")
+    name = node_link_graph_kwargs.get("name", "id")
+
+    graph = nx.DiGraph()
+    graph.graph = data.get("graph", {})
+    graph.add_nodes_from(
+        (_as_node_id(record.get(name, index)), {key: value for key, value in record.items() if key != name})
+        for index, record in enumerate(data[nodes])
+    )
+    graph.add_edges_from(
+        (
+            tuple(record[source]) if isinstance(record[source], list) else record[source],
+            tuple(record[target]) if isinstance(record[target], list) else record[target],
+            {key: value for key, value in record.items() if key != source and key != target},
+        )
+        for record in data[edges]
+    )
+    return graph
+
+
+def _as_node_id(value: Any) -> Any:
+    """Converts a JSON node identifier to a hashable one, lists becoming tuples as in `nx.node_link_graph`."""
+    return tuple(map(_as_node_id, value)) if isinstance(value, list | tuple) else value
+
+
+def load_attribute_graph(json_path: Path, use_cache: bool = True, cache_dir: Path | None = None) -> nx.DiGraph:
+    """Loads a JSON graph file and computes its attribute values, caching the result on disk.
+
+    The attribute graph is pickled in the cache directory under a hash of the JSON file content and of
+    `ATTRIBUTE_CACHE_VERSION`, so later calls on the same graph reuse it wherever the file lives and whichever command
+    loads it, and an edited file is recomputed. The least recently used cache files are deleted past `CACHE_MAX_BYTES`.
+
+    Args:
+        json_path: File path to read as NetworkX graph.
+        use_cache: Whether to read and write the pickled attribute graph. Default to True.
+        cache_dir: Directory of the pickled attribute graphs. Default to `CACHE_DIR`.
+
+    Returns:
+        NetworkX `DiGraph` with computed attribute values on each edge, see `add_max_attribute_values`.
+    """
+    json_path = Path(json_path)
+    if not use_cache:
+        return add_max_attribute_values(json_to_directed_graph(json_path), inplace=True)
+
+    # The versions are part of the key, so pickles of an older GraphScore or NetworkX are never loaded
+    hasher = hashlib.blake2b(f"{ATTRIBUTE_CACHE_VERSION}:{nx.__version__}:".encode(), digest_size=16)
+    hasher.update(json_path.read_bytes())
+    cache_path = Path(cache_dir or CACHE_DIR) / f"{hasher.hexdigest()}.pkl"
+    try:
+        with open(cache_path, "rb") as file:
+            graph = pickle.load(file)  # noqa: S301 - cache files are written by this function
+    except (OSError, EOFError, AttributeError, ImportError, pickle.UnpicklingError):
+        pass  # missing, unreadable or stale cache, rebuild it
+    else:
+        touch_cache_file(cache_path)
+        return graph
+
+    graph = add_max_attribute_values(json_to_directed_graph(json_path), inplace=True)
+    write_cache_file(pickle.dumps(graph, protocol=pickle.HIGHEST_PROTOCOL), cache_path, cache_root=cache_path.parent)
+    return graph
 
 
 def directed_graph_to_json(graph: nx.DiGraph, output_path: Path, indent: int = 2) -> None:
@@ -38,5 +140,69 @@ def directed_graph_to_json(graph: nx.DiGraph, output_path: Path, indent: int = 2
     """
     graph_data = nx.node_link_data(graph, edges="links")
     output_path.parent.mkdir(exist_ok=True, parents=True)
-    with open(output_path, "w") as file:
-        json.dump(graph_data, file, indent=indent)
+    output_path.write_bytes(_dump_json(graph_data, indent))
+
+
+def _load_json(json_path: Path) -> Any:
+    """Parses a JSON file, using `orjson` when it is installed.
+
+    Falls back to the standard library parser when `orjson` is missing or rejects the content, e.g. `NaN` values that
+    `json` accepts but are not strict JSON.
+
+    Args:
+        json_path: File path to parse.
+
+    Returns:
+        The parsed JSON content.
+    """
+    content = json_path.read_bytes()
+    if orjson is not None:
+        try:
+            return orjson.loads(content)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(content)
+
+
+def _dump_json(data: Any, indent: int | None) -> bytes:
+    """Serializes data to JSON, using `orjson` when it is installed and supports the indentation.
+
+    `orjson` writes non-finite floats as `null` where `json` writes `NaN` or `Infinity`, so data holding such values is
+    left to the standard library to keep the output readable back as the same values.
+
+    Args:
+        data: Data to serialize.
+        indent: Indentation level, `orjson` only supports None and 2.
+
+    Returns:
+        The UTF-8 encoded JSON document.
+    """
+    if orjson is not None and indent in (None, 2) and not _has_non_finite_float(data):
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, option=option)
+    return json.dumps(data, indent=indent).encode()
+
+
+def _has_non_finite_float(data: Any) -> bool:
+    """Checks whether JSON-like data holds a `NaN` or infinite float, in any nested dict, list or tuple.
+
+    Args:
+        data: Data to check.
+
+    Returns:
+        True if a non-finite float is found, as a value or a dict key.
+    """
+    stack = [data]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, float):
+            if not math.isfinite(value):
+                return True
+        elif isinstance(value, dict):
+            stack.extend(value.keys())
+            stack.extend(value.values())
+        elif isinstance(value, list | tuple):
+            stack.extend(value)
+    return False